@@ -1,6 +1,37 @@
-from machine import Pin, Timer
+from machine import Pin, Timer, disable_irq, enable_irq
+import micropython
+from micropython import const
+from os import uname
 from sys import print_exception
 
+# lets exceptions raised inside the timer callbacks report a traceback instead of being lost
+micropython.alloc_emergency_exception_buf(128)
+
+# Timer modes, looked up once rather than on every timer.init()
+_PERIODIC = Timer.PERIODIC
+_ONE_SHOT = Timer.ONE_SHOT
+
+_DEFAULT_FREQ = const(3)
+# RP2040 SIO GPIO_OUT_XOR register, every GPIO set in a mask written here flips in one store
+_SIO_GPIO_OUT_XOR = const(0xd000001c)
+# GPIO_OUT_XOR covers GPIO 0 - 29 on the RP2040
+_SIO_GPIO_COUNT = const(30)
+
+# the register only exists at that address on the RP2040, other chips fall back to Pin.value()
+if 'RP2040' in uname().machine:
+    @micropython.viper
+    def _gpio_out_xor(mask: int):
+        ptr32(_SIO_GPIO_OUT_XOR)[0] = mask
+else:
+    _gpio_out_xor = None
+
+
+def _is_sio_gpio(gpio):
+    """
+    True if gpio is a GPIO number GPIO_OUT_XOR can flip, pin names like 'GP13' are not
+    """
+    return isinstance(gpio, int) and 0 <= gpio < _SIO_GPIO_COUNT
+
 
 class DualLED:
     """
@@ -10,9 +41,24 @@ class DualLED:
     Green wire (Positive through a resistor turns GREEN on)
 
     uses the async compatible Timer to blink LEDs
+    the blinky methods run from Timer callbacks (interrupt context), which relies on the
+    emergency exception buffer allocated when this module is imported
     """
-    COLORS = ['RED', 'GREEN']
-    DEFAULT_FREQ = 3.0
+    COLORS = ('RED', 'GREEN')
+    DEFAULT_FREQ = _DEFAULT_FREQ
+    # restore_state handlers, keyed on the action in the state tuple (or split state string)
+    _RESTORE = {
+        # ('OFF',)
+        'OFF': lambda self, p: self.off(),
+        # ('ON', c)
+        'ON': lambda self, p: self.on(p[1]),
+        # ('BLINK', c, freq)
+        'BLINK': lambda self, p: self.blink(freq=p[-1], color=p[1]),
+        # ('COUNT', c, number, freq)
+        'COUNT': lambda self, p: self.count_number(p[2], freq=p[-1], color=p[1]),
+        # ('ALTERNATE', '', freq)
+        'ALTERNATE': lambda self, p: self.alternate_colors(freq=p[-1]),
+    }
 
     def __init__(self, gpio_0, gpio_1, primary_color, freq=None):
         """
@@ -29,38 +75,97 @@ class DualLED:
         self.primary_led = None
         self.secondary_led = None
         self.timer = None
+        self._timer_armed = False
         self.tick_count = 0
-        self.color_map = dict()
+        self._leds = ()
+        self._color_idx = dict()
+        self._primary_idx = 0
         self.state = None
         self.__led_0 = None
         self.__led_1 = None
+        # timer callback state, read by the _cb_* methods below
+        # _bits caches the LED outputs (bit 0 = __led_0, bit 1 = __led_1) so the callbacks
+        # flip bits and write the pins, rather than read-modify-write each Pin with toggle()
+        self._bits = 0
+        # bound Pin.value methods, fetched once so on/off and the callbacks skip the attribute lookup
+        self._v0 = None
+        self._v1 = None
+        self._values = ()
+        self._blink_mask = 0
+        self._blink_value = None
+        # GPIO_OUT_XOR masks, bit n = GPIO n, only set when setup_control picks the XOR callbacks
+        self._gpio_masks = (0, 0)
+        self._blink_gpio = 0
+        self._both_mask = 0
+        self._count_target = 0
+        # timer periods in ms, computed when a blinky method is armed rather than on every re-arm
+        self._period_ms = 0
+        self._pause_ms = 0
+        # (freq, half period in ms) of the last arm, re-arming at the same freq skips the division
+        self._period_cache = (None, 0)
+        # bind the timer callbacks once, so arming a timer never allocates a new closure/bound method
+        # _bound_blink/_bound_both are picked per instance in setup_control, they depend on the pins
+        self._bound_blink = self._cb_toggle_blink
+        self._bound_both = self._cb_toggle_both
+        self._bound_count = self._cb_toggle_count
+        self._bound_restart = self._cb_restart_count
         self.setup_control(self.primary_color)
         self.off()
 
     def set_primary_color(self, color):
-        color = color.upper()
-        if color not in self.COLORS:
-            raise ValueError(f"primary color must be one of {self.COLORS} not {color}")
-        self.primary_color = color
-        if self.primary_color == self.COLORS[0]:
-            self.primary_led, self.secondary_led = self.__led_0, self.__led_1
-        else:
-            self.primary_led, self.secondary_led = self.__led_1, self.__led_0
+        i = self._color_idx.get(color.upper())
+        if i is None:
+            raise ValueError(f"primary color must be one of {self.COLORS} not {color.upper()}")
+        # resolved once here, everything else works from the int index
+        self._primary_idx = i
+        self.primary_led, self.secondary_led = self._leds[i], self._leds[i ^ 1]
+        self.primary_color = self.COLORS[i]
 
     def setup_control(self, primary_color):
         self.__led_0 = Pin(self.gpio_0, Pin.OUT, value=0)
         self.__led_1 = Pin(self.gpio_1, Pin.OUT, value=0)
-        self.color_map = {
-            self.COLORS[0]: self.__led_0,
-            self.COLORS[1]: self.__led_1
-        }
+        # one long lived Timer, re-targeted with init() rather than re-allocated on every change
+        self.timer = Timer(-1)
+        # index 0 is COLORS[0], index 1 is COLORS[1]; the sibling of index i is always i ^ 1
+        self._leds = (self.__led_0, self.__led_1)
+        self._v0 = self.__led_0.value
+        self._v1 = self.__led_1.value
+        self._values = (self._v0, self._v1)
+        self._bits = 0
+        if _gpio_out_xor and _is_sio_gpio(self.gpio_0) and _is_sio_gpio(self.gpio_1):
+            self._gpio_masks = (1 << self.gpio_0, 1 << self.gpio_1)
+            self._both_mask = self._gpio_masks[0] | self._gpio_masks[1]
+            self._bound_blink = self._cb_xor_blink
+            self._bound_both = self._cb_xor_both
+        else:
+            # not an RP2040, or pins given by name, so blink/alternate with Pin.value()
+            self._gpio_masks = (0, 0)
+            self._both_mask = 0
+            self._bound_blink = self._cb_toggle_blink
+            self._bound_both = self._cb_toggle_both
+        self._color_idx = {c: i for i, c in enumerate(self.COLORS)}
         self.set_primary_color(primary_color)
         
+    def _coerce_freq(self, freq):
+        """
+        freq as a float, self.freq if not given
+        restore_state passes freq as a string, e.g. '5.0'
+        """
+        freq = freq or self.freq
+        return freq if isinstance(freq, float) else float(freq)
+
+    def _half_period_ms(self, freq):
+        """
+        timer period in ms to toggle at, half of 1/freq so each blink is on half, off half
+        """
+        if self._period_cache[0] != freq:
+            self._period_cache = (freq, max(1, int(500 / freq)))
+        return self._period_cache[1]
+
     def stop_timer(self):
-        if self.timer:
+        if self._timer_armed:
             self.timer.deinit()
-            del self.timer
-            self.timer = None
+            self._timer_armed = False
         self.tick_count = 0
 
     def led_for_color(self, color=None):
@@ -69,22 +174,35 @@ class DualLED:
         if matches self.COLORS[0] (normally RED)   returns __led_0, __led_1, color
         if matches self.COLORS[1] (normally GREEN) returns __led_1, __led_0, color
         """
+        i = self._color_index(color)
+        return self._leds[i], self._leds[i ^ 1], self.COLORS[i]
+
+    def _color_index(self, color=None):
+        """
+        index into self.COLORS / self._leds for the color, primary if None
+        """
         if not color:
-            return self.primary_led, self.secondary_led, self.primary_color
-        if color.upper() not in self.COLORS:
+            return self._primary_idx
+        i = self._color_idx.get(color.upper())
+        if i is None:
             raise ValueError(f"color must be None or one of {self.COLORS} not {color}")
-        pos = self.COLORS.index(color.upper())
-        other = (pos + 1) % 2
-        return self.color_map[self.COLORS[pos]], self.color_map[self.COLORS[other]], color.upper()
+        return i
 
     def off(self):
         """
         Turn both off
         """
         self.stop_timer()
-        self.__led_0.value(0)
-        self.__led_1.value(0)
-        self.state = 'OFF'
+        self._reset_pins()
+        self.state = ('OFF',)
+
+    def _reset_pins(self):
+        """
+        write both LEDs off, without touching the timer
+        """
+        self._v0(0)
+        self._v1(0)
+        self._bits = 0
 
     def on(self, color=None):
         """
@@ -92,15 +210,16 @@ class DualLED:
         Or turn selected color on, other color off
         """
         self.stop_timer()
-        p, s, c = self.led_for_color(color)
-        s.value(0)
-        p.value(1)
-        self.state = f"ON:{c}"
+        i = self._color_index(color)
+        self._values[i ^ 1](0)
+        self._values[i](1)
+        self._bits = 1 << i
+        self.state = ('ON', self.COLORS[i])
 
     def toggle(self, color=None):
         self.stop_timer()
         p, s, c = self.led_for_color(color)
-        if self.state != 'OFF':
+        if self.state[0] != 'OFF':
             self.off()
         else:
             self.on(c)
@@ -109,37 +228,35 @@ class DualLED:
         """
         read current state of LEDs
         return on/off status of each LED, and the current action state (on/off/blinking, etc.)
+        the action state is only formatted into a string here, e.g. 'BLINK:RED:3.0Hz'
         """
-        state = {'STATE': self.state}
+        text = ':'.join(str(x) for x in self.state)
+        if len(self.state) > 2:  # blinky states end in a frequency
+            text += 'Hz'
+        state = {'STATE': text}
         state.update({
-            c: k.value() for c, k in self.color_map.items()})
+            c: k.value() for c, k in zip(self.COLORS, self._leds)})
         return state
 
-    def restore_state(self, **kwargs):
+    def restore_state(self, state=None, **kwargs):
         """
-        from the state string, restore the LED function
-        :param kwargs: must have a state or STATE parameter other values are ignored
+        from the state, restore the LED function
+        :param state: state tuple as stored in self.state, or the string from get_state(),
+                      e.g. ('BLINK', 'RED', 3.0) or 'BLINK:RED:3.0Hz'
+        :param kwargs: if state is not given, must have a STATE parameter other values are ignored
+                       so the dict from get_state() can be passed back with **
         """
         try:
-            state = [
-                v for k, v in kwargs.items()
-                if k.lower() == 'state'][0].split(':')
-            if state[0] == 'OFF':
-                self.off()
-            elif state[0] == 'ON':
-                # self.state = f"ON:{c}"
-                self.on(state[1])
-            elif state[0] == 'BLINK':
-                # self.state = f"BLINK:{c}:{freq}Hz"
-                self.blink(freq=state[-1][:-2], color=state[1])
-            elif state[0] == 'COUNT':
-                # self.state = f"COUNT:{c}:{number}:{freq}Hz"
-                self.count_number(state[2], freq=state[-1][:-2], color=state[1])
-                pass
-            elif state[0] == 'ALTERNATE':
-                # self.state = f'ALTERNATE::{freq}Hz'
-                self.alternate_colors(freq=state[-1][:-2])
-                pass
+            if state is None:
+                state = kwargs['STATE']
+            parts = state
+            if isinstance(state, str):
+                parts = state.split(':')
+                if parts[-1].endswith('Hz'):
+                    parts[-1] = parts[-1][:-2]
+            handler = self._RESTORE.get(parts[0])
+            if handler:
+                handler(self, parts)
         except Exception as e:
             print_exception(e)
 
@@ -149,38 +266,36 @@ class DualLED:
         freq - Times to blink per second
         color - defaults to primary, but can override by setting color
         """
-        freq = freq or self.freq
-        freq = float(freq)
+        freq = self._coerce_freq(freq)
         self.stop_timer()
-        self.off()
-        to_blink, _, c = self.led_for_color(color)
-        self.state = f"BLINK:{c}:{freq}Hz"
+        self._reset_pins()
+        self.state = ('OFF',)
+        i = self._color_index(color)
+        c = self.COLORS[i]
+        self._blink_mask = 1 << i
+        self._blink_value = self._values[i]
+        self._blink_gpio = self._gpio_masks[i]
+        self.state = ('BLINK', c, freq)
 
-        def toggle_blinker(_t):
-            to_blink.toggle()    
-        
-        self.timer = Timer()
-        # need a * 2 on the frequency because we Toggle at the frequency rather than on half - off half
-        self.timer.init(mode=Timer.PERIODIC, freq=freq * 2, callback=toggle_blinker)
+        # toggle every half period because we Toggle at the frequency rather than on half - off half
+        self._period_ms = self._half_period_ms(freq)
+        self.timer.init(mode=_PERIODIC, period=self._period_ms, callback=self._bound_blink)
+        self._timer_armed = True
 
     def alternate_colors(self, freq=None):
         """
         Primary On, Secondary Off, then toggle both periodically
         freq - (frequency) times per second to alternate
         """
-        freq = freq or self.freq
-        freq = float(freq)
+        freq = self._coerce_freq(freq)
         self.stop_timer()
         self.on()  # Primary set to on, secondary off
-        self.state = f'ALTERNATE::{freq}Hz'
+        self.state = ('ALTERNATE', '', freq)
 
-        def __toggle_both(_t):
-            self.secondary_led.toggle()
-            self.primary_led.toggle()
-        
-        self.timer = Timer()
-        # need a * 2 on the frequency because we Toggle at the frequency rather than on half off half
-        self.timer.init(mode=Timer.PERIODIC, freq=freq * 2, callback=__toggle_both)
+        # toggle every half period because we Toggle at the frequency rather than on half off half
+        self._period_ms = self._half_period_ms(freq)
+        self.timer.init(mode=_PERIODIC, period=self._period_ms, callback=self._bound_both)
+        self._timer_armed = True
 
     def count_number(self, number, freq=None, color=None):
         """
@@ -196,31 +311,80 @@ class DualLED:
         number = 2
         Blink-Blink Pause, Blink-Blink Pause, etc.
         """
-        freq = freq or self.freq
-        freq = float(freq)
+        freq = self._coerce_freq(freq)
         number = int(number)
-        self.off()  # Turn both colors off
+        # stop first, so an old tick can't flip the pins while the count state is set up
+        self.stop_timer()
+        self._reset_pins()  # Turn both colors off
+        self.state = ('OFF',)
 
-        to_blink, _, c = self.led_for_color(color)
-        self.state = f"COUNT:{c}:{number}:{freq}Hz"
-        
-        def __start_count(_t):
+        i = self._color_index(color)
+        c = self.COLORS[i]
+        self._blink_mask = 1 << i
+        self._blink_value = self._values[i]
+        self._blink_gpio = self._gpio_masks[i]
+        self._count_target = number
+        self._period_ms = self._half_period_ms(freq)
+        self._pause_ms = int(4000 / freq)
+        self.state = ('COUNT', c, number, freq)
+
+        self._cb_restart_count(None)  # Kick off the action
+
+    @micropython.native
+    def _cb_toggle_blink(self, _t):
+        """
+        flip the blinking LED with Pin.value(), returns the new LED bits
+        """
+        b = self._bits ^ self._blink_mask
+        self._bits = b
+        self._blink_value(b & self._blink_mask)
+        return b
+
+    @micropython.native
+    def _cb_xor_blink(self, _t):
+        """
+        flip the blinking LED with one GPIO_OUT_XOR store, returns the new LED bits
+        """
+        b = self._bits ^ self._blink_mask
+        self._bits = b
+        _gpio_out_xor(self._blink_gpio)
+        return b
+
+    @micropython.native
+    def _cb_toggle_both(self, _t):
+        b = self._bits ^ 0b11
+        self._bits = b
+        self._v0(b & 1)
+        self._v1(b >> 1)
+
+    @micropython.native
+    def _cb_xor_both(self, _t):
+        self._bits ^= 0b11
+        _gpio_out_xor(self._both_mask)
+
+    def _cb_restart_count(self, _t):
+        # IRQs off, so nothing can re-arm the timer between the deinit and init
+        irq_state = disable_irq()
+        try:
             self.stop_timer()
-            self.tick_count = 0
-            self.timer = Timer()
-            self.timer.init(mode=Timer.PERIODIC, freq=freq * 2, callback=__toggle_with_count)
-        
-        def __toggle_with_count(_t):
-            to_blink.toggle()
-            if to_blink.value():  # True implies 1 == ON 0 == OFF
-                self.tick_count += 1
-            else:
-                # since led is off, check our tick_count
-                if self.tick_count >= number:
+            self.timer.init(mode=_PERIODIC, period=self._period_ms, callback=self._bound_count)
+            self._timer_armed = True
+        finally:
+            enable_irq(irq_state)
+
+    @micropython.native
+    def _cb_toggle_count(self, _t):
+        if self._bound_blink(_t) & self._blink_mask:  # True implies 1 == ON 0 == OFF
+            self.tick_count += 1
+        else:
+            # since led is off, check our tick_count
+            if self.tick_count >= self._count_target:
+                irq_state = disable_irq()
+                try:
                     # kill our current timer
                     self.stop_timer()
-                    # start a NEW one shot timer to kick it off again
-                    self.timer = Timer()
-                    self.timer.init(mode=Timer.ONE_SHOT, period=int(4000/freq), callback=__start_count)
-
-        __start_count(None)  # Kick off the action
+                    # re-arm the same timer as a one shot to kick it off again
+                    self.timer.init(mode=_ONE_SHOT, period=self._pause_ms, callback=self._bound_restart)
+                    self._timer_armed = True
+                finally:
+                    enable_irq(irq_state)
@@ -7,7 +7,7 @@ class BlueYellowDualLED(DualLED):
     """
     Example class if your colors are not Red/Green
     """
-    COLORS = ['BLUE', 'YELLOW']  # or whatever you want.
+    COLORS = ('BLUE', 'YELLOW')  # or whatever you want.
 
 
 def show_state(led):
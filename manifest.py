@@ -0,0 +1,4 @@
+# Freeze dual_led into the MicroPython firmware, so its bytecode runs from flash instead of RAM:
+#   make -C ports/rp2 BOARD=RPI_PICO (or RPI_PICO_W) FROZEN_MANIFEST=/path/to/pico-dual-led/manifest.py
+include("$(PORT_DIR)/boards/manifest.py")
+module("dual_led.py", base_path="code", opt=2)